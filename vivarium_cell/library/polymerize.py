@@ -1,4 +1,5 @@
 import random
+from collections import defaultdict
 
 import numpy as np
 import logging as log
@@ -209,14 +210,15 @@ def polymerize_step(
         symbol_to_monomer,
         monomer_limits):
 
-    complete_polymers = {
-        product: 0
-        for product in all_products(templates)}
+    complete_polymers = {}
 
-    monomers = {
-        monomer: 0
-        for monomer in monomer_limits.keys()}
-    terminated = 0
+    # monomer limits may be a dict keyed by monomer name or a flat array
+    # indexed by monomer id; mirror its shape for the consumed counts
+    if isinstance(monomer_limits, np.ndarray):
+        monomers = np.zeros_like(monomer_limits)
+    else:
+        monomers = defaultdict(int)
+    completed_ids = []
 
     for polymerase in polymerases.values():
         if polymerase.is_polymerizing():
@@ -229,7 +231,10 @@ def polymerize_step(
                 log.error('index beyond sequence: polymerase - {} template - {}'.format(
                     polymerase,
                     template))
-                monomer_symbol = random.choice(list(symbol_to_monomer.keys()))
+                if isinstance(symbol_to_monomer, np.ndarray):
+                    monomer_symbol = random.randrange(len(symbol_to_monomer))
+                else:
+                    monomer_symbol = random.choice(list(symbol_to_monomer.keys()))
 
             monomer = symbol_to_monomer[monomer_symbol]
 
@@ -244,19 +249,21 @@ def polymerize_step(
                 if terminator.position == absolute_position:
                     if template.terminates_at(polymerase.terminator):
                         polymerase.complete()
-                        terminated += 1
+                        completed_ids.append(polymerase.id)
 
                         for product in terminator.products:
-                            complete_polymers[product] += 1
+                            complete_polymers[product] = \
+                                complete_polymers.get(product, 0) + 1
                     else:
                         polymerase.terminator += 1
 
-    polymerases = {
-        id: polymerase
-        for id, polymerase in polymerases.items()
-        if not polymerase.is_complete()}
+    if completed_ids:
+        polymerases = {
+            id: polymerase
+            for id, polymerase in polymerases.items()
+            if not polymerase.is_complete()}
 
-    return monomers, monomer_limits, terminated, complete_polymers, polymerases
+    return monomers, monomer_limits, completed_ids, complete_polymers, polymerases
     
 
 def polymerize_to(
@@ -267,10 +274,12 @@ def polymerize_to(
         symbol_to_monomer,
         monomer_limits):
 
+    completed_ids = []
     for step in range(additions):
-        monomers, monomer_limits, terminated, complete_polymers, polymerases = polymerize_step(
+        monomers, monomer_limits, completed, complete_polymers, polymerases = polymerize_step(
             sequences, polymerases, templates, symbol_to_monomer, monomer_limits)
-    return monomers, monomer_limits, terminated, complete_polymers, polymerases
+        completed_ids.extend(completed)
+    return monomers, monomer_limits, completed_ids, complete_polymers, polymerases
 
 
 class Elongation(object):
@@ -284,27 +293,35 @@ class Elongation(object):
         self.sequence = sequence
         self.templates = templates
         self.time = 0
-        self.monomers = {}
+        if isinstance(limits, np.ndarray):
+            self.monomers = np.zeros_like(limits)
+        else:
+            self.monomers = {}
         self.symbol_to_monomer = symbol_to_monomer
         self.complete_polymers = {}
+        self.completed_ids = []
         self.previous_elongations = int(elongation)
         self.elongation = elongation
         self.limits = limits
 
     def step(self, interval, limits, polymerases):
         self.time += interval
-        monomers, limits, terminated, complete, polymerases = polymerize_step(
+        monomers, limits, completed, complete, polymerases = polymerize_step(
             self.sequence,
             polymerases,
             self.templates,
             self.symbol_to_monomer,
             limits)
 
-        self.monomers = add_merge([self.monomers, monomers])
+        self.completed_ids.extend(completed)
+        if isinstance(monomers, np.ndarray):
+            self.monomers += monomers
+        else:
+            self.monomers = add_merge([self.monomers, monomers])
         self.complete_polymers = add_merge([
             self.complete_polymers, complete])
 
-        return terminated, limits, polymerases
+        return len(completed), limits, polymerases
 
     def store_partial(self, interval):
         self.elongation += interval
@@ -322,22 +339,26 @@ class Elongation(object):
         self.elongation += progress
         elongations = int(self.elongation) - self.previous_elongations
         self.time = now
-        terminated = 0
+        completed = []
 
         if elongations:
-            monomers, limits, terminated, complete, polymerases = polymerize_to(
+            monomers, limits, completed, complete, polymerases = polymerize_to(
                 self.sequence,
                 polymerases,
                 self.templates,
                 elongations,
                 self.symbol_to_monomer,
                 limits)
-            self.monomers = add_merge([self.monomers, monomers])
+            self.completed_ids.extend(completed)
+            if isinstance(monomers, np.ndarray):
+                self.monomers += monomers
+            else:
+                self.monomers = add_merge([self.monomers, monomers])
             self.complete_polymers = add_merge([
                 self.complete_polymers, complete])
             self.previous_elongations = int(self.elongation)
 
-        return terminated, limits, polymerases
+        return len(completed), limits, polymerases
 
     def complete(self):
         return len(self.complete_polymers)
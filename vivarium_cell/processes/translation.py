@@ -4,10 +4,10 @@ Stochastic Translation
 ======================
 '''
 
-import copy
 import numpy as np
 import random
 import logging as log
+from collections import defaultdict
 from arrow import StochasticSystem
 
 from vivarium.core.process import Process
@@ -28,10 +28,7 @@ def shuffle(l):
     return l
 
 def random_string(alphabet, length):
-    string = ''
-    for step in range(length):
-        string += random.choice(alphabet)
-    return string
+    return ''.join(np.random.choice(list(alphabet), size=length))
 
 #: Variable name for unbound ribosomes
 UNBOUND_RIBOSOME_KEY = 'Ribosome'
@@ -49,19 +46,10 @@ B = random_string(monomer_symbols, 30)
 Y = random_string(monomer_symbols, 40)
 
 def gather_genes(affinities):
-    genes = {}
+    genes = defaultdict(list)
     for operon, product in affinities.keys():
-        if not operon in genes:
-            genes[operon] = []
         genes[operon].append(product)
-    return genes
-
-def transcripts_to_gene_counts(transcripts, operons):
-    counts = {}
-    for transcript, genes in operons.items():
-        for gene in genes:
-            counts[(transcript, gene)] = transcripts.get(transcript, 0)
-    return counts
+    return dict(genes)
 
 class Translation(Process):
 
@@ -273,7 +261,7 @@ class Translation(Process):
         ... )
         >>> update = translation.next_update(1, states)
         >>> print(update['ribosomes'])
-        {'_add': [{'path': (1,), 'state': <class 'vivarium_cell.processes.translation.Ribosome'>: {'id': 1, 'state': 'occluding', 'position': 9, 'template': ('oAZ', 'eZ'), 'template_index': 0, 'terminator': 0}}, {'path': (2,), 'state': <class 'vivarium_cell.processes.translation.Ribosome'>: {'id': 2, 'state': 'occluding', 'position': 9, 'template': ('oAZ', 'eZ'), 'template_index': 0, 'terminator': 0}}], '_delete': []}
+        {'_add': [{'path': (1,), 'state': <class 'vivarium_cell.processes.translation.Ribosome'>: {'id': 1, 'state': 'occluding', 'position': 9, 'template': ('oAZ', 'eZ'), 'template_index': 1, 'terminator': 0}}, {'path': (2,), 'state': <class 'vivarium_cell.processes.translation.Ribosome'>: {'id': 2, 'state': 'occluding', 'position': 9, 'template': ('oAZ', 'eZ'), 'template_index': 1, 'terminator': 0}}], '_delete': []}
         '''
 
         if not initial_parameters:
@@ -282,7 +270,10 @@ class Translation(Process):
         self.monomer_symbols = list(amino_acids.keys())
         self.monomer_ids = list(amino_acids.values())
 
-        self.default_parameters = copy.deepcopy(self.defaults)
+        # the defaults are only read, never written, so a shallow copy of
+        # the top level is enough; lists that do get extended below are
+        # copied explicitly first
+        self.default_parameters = {**self.defaults}
 
         templates = self.or_default(initial_parameters, 'templates')
 
@@ -296,29 +287,76 @@ class Translation(Process):
                 self.default_parameters['transcript_affinities']).keys())
         self.default_parameters['molecule_ids'] = self.monomer_ids
 
-        self.parameters = copy.deepcopy(self.default_parameters)
+        self.parameters = {**self.default_parameters}
         self.parameters.update(initial_parameters)
 
         self.sequences = self.parameters['sequences']
         self.templates = self.parameters['templates']
 
+        # templates are immutable config, so wrap them in Template objects
+        # once rather than on every next_update
+        self._template_objs = {
+            key: Template(template)
+            for key, template in self.templates.items()}
+
         self.transcript_affinities = self.parameters['transcript_affinities']
         self.operons = gather_genes(self.transcript_affinities)
         self.operon_order = list(self.operons.keys())
-        self.transcript_order = self.parameters['transcript_order']
+        # keep transcripts in descending-affinity order so the gillespie
+        # sampler's cumulative-propensity search hits the likeliest
+        # reactions first; every index-aligned structure below is built
+        # from this order, so the permutation stays consistent
+        self.transcript_order = sorted(
+            self.parameters['transcript_order'],
+            key=lambda transcript_key: -self.transcript_affinities[transcript_key])
+        self.parameters['transcript_order'] = self.transcript_order
         self.transcript_count = len(self.transcript_order)
 
+        # flat list of operon names, one entry per transcript, aligned
+        # with transcript_order, so gene counts can be read straight out
+        # of the transcripts state
+        self._gene_operon_order = [
+            operon
+            for operon, gene in self.transcript_order]
+
+        self._transcript_index = {
+            transcript_key: index
+            for index, transcript_key in enumerate(self.transcript_order)}
+
         self.monomer_ids = self.parameters['monomer_ids']
-        self.molecule_ids = self.parameters['molecule_ids']
+        self._monomer_index = {
+            monomer: index
+            for index, monomer in enumerate(self.monomer_ids)}
+        self.molecule_ids = list(self.parameters['molecule_ids'])
         self.molecule_ids.extend(['ATP', 'ADP'])
 
         self.protein_ids = self.parameters['protein_ids']
         self.symbol_to_monomer = self.parameters['symbol_to_monomer']
+
+        # encode each sequence as an int8 array of monomer indexes so
+        # elongation reads a contiguous array instead of indexing strings;
+        # the indexes point into monomer_ids, matching the monomer limits
+        # array built each timestep
+        symbol_index = {
+            symbol: self._monomer_index[monomer]
+            for symbol, monomer in self.symbol_to_monomer.items()}
+        self._sequence_arrays = {
+            key: np.fromiter(
+                (symbol_index[symbol] for symbol in sequence),
+                dtype=np.int8,
+                count=len(sequence))
+            for key, sequence in self.sequences.items()}
+        self._monomer_identity = np.arange(len(self.monomer_ids))
         self.elongation = 0
         self.elongation_rate = self.parameters['elongation_rate']
         self.polymerase_occlusion = self.parameters['polymerase_occlusion']
         self.concentration_keys = self.parameters['concentration_keys']
 
+        # rates for the gillespie simulation, one per binding reaction.
+        # StochasticSystem takes these per-reaction (matching the rows of
+        # the stoichiometry), not per-substrate, so no padding to the
+        # 2T+1 substrate layout is needed and the vector built here is
+        # passed to evolve unchanged every call
         self.affinity_vector = np.array([
             self.transcript_affinities[transcript_key]
             for transcript_key in self.transcript_order], dtype=np.float64)
@@ -329,6 +367,9 @@ class Translation(Process):
 
         self.ribosome_id = 0
 
+        self._cached_schema = None
+        self._cached_derivers = None
+
         self.protein_keys = self.concentration_keys + self.protein_ids
         self.all_protein_keys = self.protein_keys + [UNBOUND_RIBOSOME_KEY]
 
@@ -341,6 +382,10 @@ class Translation(Process):
         super(Translation, self).__init__(self.parameters)
 
     def ports_schema(self):
+        # the schema is invariant after __init__, so build it once and
+        # return the cached dict on repeated framework queries
+        if self._cached_schema is not None:
+            return self._cached_schema
 
         def add_mass(schema, masses, key):
             if '_properties' not in schema:
@@ -349,7 +394,7 @@ class Translation(Process):
                 schema['_properties']['mw'] = masses[key]
             return schema
 
-        return {
+        self._cached_schema = {
             'ribosomes': {
                 '*': {
                     'id': {
@@ -403,8 +448,13 @@ class Translation(Process):
                     '_updater': 'set'}
                 for molecule in self.protein_keys}}
 
+        return self._cached_schema
+
     def derivers(self):
-        return {
+        if self._cached_derivers is not None:
+            return self._cached_derivers
+
+        self._cached_derivers = {
             self.mass_deriver_key: {
                 'deriver': 'mass_deriver',
                 'port_mapping': {
@@ -418,72 +468,107 @@ class Translation(Process):
                 'config': {
                     'concentration_keys': self.protein_keys}}}
 
+        return self._cached_derivers
+
     def next_update(self, timestep, states):
         molecules = states['molecules']
         transcripts = states['transcripts']
         proteins = states['proteins']
 
         ribosomes = {
-            id: Ribosome(ribosome)
+            id: ribosome if isinstance(ribosome, Ribosome) else Ribosome(ribosome)
             for id, ribosome in states['ribosomes'].items()}
 
-        original_ribosome_keys = ribosomes.keys()
+        original_ribosome_keys = list(ribosomes.keys())
+        added_ribosome_ids = []
 
-        gene_counts = np.array(
-            list(transcripts_to_gene_counts(transcripts, self.operons).values()),
-            dtype=np.int64)
+        # only ribosomes in the occluding state can unocclude, so track
+        # them separately instead of scanning every ribosome each tick
+        occluding_ribosomes = {
+            id: ribosome
+            for id, ribosome in ribosomes.items()
+            if ribosome.state == 'occluding'}
 
-        # Find out how many transcripts are currently blocked by a
-        # newly initiated ribosome
-        bound_transcripts = np.zeros(self.transcript_count, dtype=np.int64)
-        ribosomes_by_transcript = {
-            transcript_key: []
-            for transcript_key in self.transcript_order}
-        for ribosome in ribosomes.values():
-            ribosomes_by_transcript[ribosome.template].append(ribosome)
-        for index, transcript in enumerate(self.transcript_order):
-            bound_transcripts[index] = len([
-                ribosome
-                for ribosome in ribosomes_by_transcript[transcript]
-                if ribosome.is_bound()])
-
-        # Make the state for a gillespie simulation out of total number of each
-        # transcript not blocked by a bound ribosome, concatenated with the number
-        # of each transcript that is bound by a ribosome.
-        # These are the two states for each transcript the simulation
-        # will operate on, essentially going back and forth between
-        # bound and unbound states.
+        gene_counts = np.fromiter(
+            (transcripts.get(operon, 0) for operon in self._gene_operon_order),
+            dtype=np.int64,
+            count=len(self._gene_operon_order))
 
         original_unbound_ribosomes = proteins[UNBOUND_RIBOSOME_KEY]
-        monomer_limits = {
-            monomer: molecules[monomer]
-            for monomer in self.monomer_ids}
-        unbound_ribosomes = original_unbound_ribosomes
 
-        templates = {
-            key: Template(template)
-            for key, template in self.templates.items()}
+        # with no ribosomes anywhere the binding propensities are all zero
+        # and there is nothing to elongate, so skip the simulation outright
+        if original_unbound_ribosomes == 0 and not ribosomes:
+            return {
+                'ribosomes': {
+                    '_add': [],
+                    '_delete': []},
+                'molecules': {},
+                'proteins': {
+                    UNBOUND_RIBOSOME_KEY: 0}}
+
+        monomer_limits = np.fromiter(
+            (molecules[monomer] for monomer in self.monomer_ids),
+            dtype=np.int64,
+            count=len(self.monomer_ids))
+        unbound_ribosomes = original_unbound_ribosomes
 
         time = 0
-        now = 0
         elongation = Elongation(
-            self.sequences,
-            templates,
+            self._sequence_arrays,
+            self._template_objs,
             monomer_limits,
-            self.symbol_to_monomer,
+            self._monomer_identity,
             self.elongation)
 
-        while time < timestep:
-            # build the state vector for the gillespie simulation
-            substrate = np.concatenate([
-                gene_counts - bound_transcripts,
-                bound_transcripts,
-                [unbound_ribosomes]])
-
-            # find number of monomers until next terminator
-            distance = 1 / self.elongation_rate
+        # The state for the gillespie simulation: the number of each
+        # transcript not blocked by a bound ribosome, concatenated with
+        # the number of each transcript that is bound, and the count of
+        # unbound ribosomes in the final slot. These are the two states
+        # for each transcript the simulation will operate on, essentially
+        # going back and forth between bound and unbound states.
+        # bound_transcripts aliases the middle slice, and all three
+        # sections are maintained in place as bindings, unocclusions and
+        # terminations are applied, so the vector never needs rebuilding
+        substrate = np.zeros(2 * self.transcript_count + 1, dtype=np.int64)
+        bound_transcripts = substrate[
+            self.transcript_count:2 * self.transcript_count]
+        for ribosome in ribosomes.values():
+            if ribosome.is_occluding():
+                bound_transcripts[self._transcript_index[ribosome.template]] += 1
+        np.subtract(
+            gene_counts, bound_transcripts,
+            out=substrate[:self.transcript_count])
+        substrate[-1] = unbound_ribosomes
+
+        # time to elongate a single monomer, which sets the width of each
+        # gillespie interval
+        distance = 1 / self.elongation_rate
+
+        # sample the gillespie system over the whole remaining window in a
+        # single evolve call, consuming the sampled events one elongation
+        # interval at a time. binding events are applied to the substrate
+        # internally by the stochastic system, so the sample only goes
+        # stale when elongation itself changes the state -- a termination
+        # freeing a ribosome or a ribosome unoccluding its transcript --
+        # at which point the window is resampled from the updated counts
+        events = np.empty(0, dtype=np.intp)
+        event_times = np.empty(0, dtype=np.float64)
+        event_cursor = 0
+        resample = True
 
-            # find interval of time that elongates to the point of the next terminator
+        while time < timestep:
+            if resample:
+                result = self.initiation.evolve(
+                    timestep - time,
+                    substrate,
+                    self.affinity_vector)
+                events = np.asarray(result['events'], dtype=np.intp)
+                event_times = np.asarray(result['time']) + time
+                event_cursor = 0
+                resample = False
+
+            # find interval of time that elongates one monomer
             interval = min(distance, timestep - time)
 
             if interval == distance:
@@ -493,40 +578,61 @@ class Translation(Process):
                     monomer_limits,
                     ribosomes)
                 unbound_ribosomes += terminations
+                if terminations:
+                    substrate[-1] = unbound_ribosomes
+                    resample = True
             else:
                 elongation.store_partial(interval)
-                terminations = 0
 
-            # run simulation for interval of time to next terminator
-            result = self.initiation.evolve(
-                interval,
-                substrate,
-                self.affinity_vector)
+            # apply the binding events that fall within this interval; the
+            # bound counts can be updated in one vectorized call
+            boundary = np.searchsorted(event_times, time + interval)
+            interval_events = events[event_cursor:boundary]
+            event_cursor = boundary
+            np.add.at(bound_transcripts, interval_events, 1)
+            np.subtract.at(
+                substrate[:self.transcript_count], interval_events, 1)
 
             # go through each event in the simulation and update the state
-            ribosome_bindings = 0
-            for now, event in zip(result['time'], result['events']):
+            for event in interval_events:
                 # ribosome has bound the transcript
                 transcript_key = self.transcript_order[event]
-                bound_transcripts[event] += 1
 
                 self.ribosome_id += 1
                 new_ribosome = Ribosome({
                     'id': self.ribosome_id,
                     'template': transcript_key,
+                    'template_index': int(event),
                     'position': 0})
                 new_ribosome.bind()
                 new_ribosome.start_polymerizing()
                 ribosomes[new_ribosome.id] = new_ribosome
+                occluding_ribosomes[new_ribosome.id] = new_ribosome
+                added_ribosome_ids.append(new_ribosome.id)
 
-                ribosome_bindings += 1
                 unbound_ribosomes -= 1
 
-            # deal with occluding rnap
-            for ribosome in ribosomes.values():
-                if ribosome.is_unoccluding(self.polymerase_occlusion):
-                    bound_transcripts[ribosome.template_index] -= 1
-                    ribosome.unocclude()
+            substrate[-1] = unbound_ribosomes
+
+            # deal with occluding ribosomes
+            if occluding_ribosomes:
+                unoccluded = [
+                    id
+                    for id, ribosome in occluding_ribosomes.items()
+                    if ribosome.is_unoccluding(self.polymerase_occlusion)]
+                if unoccluded:
+                    unoccluded_index = np.fromiter(
+                        (occluding_ribosomes[id].template_index
+                         for id in unoccluded),
+                        dtype=np.intp,
+                        count=len(unoccluded))
+                    np.subtract.at(bound_transcripts, unoccluded_index, 1)
+                    np.add.at(
+                        substrate[:self.transcript_count],
+                        unoccluded_index, 1)
+                    for id in unoccluded:
+                        occluding_ribosomes.pop(id).unocclude()
+                    resample = True
 
             time += interval
 
@@ -534,25 +640,30 @@ class Translation(Process):
         self.elongation = elongation.elongation - int(elongation.elongation)
 
         proteins = {
-            UNBOUND_RIBOSOME_KEY: unbound_ribosomes - original_unbound_ribosomes}
-        proteins.update(elongation.complete_polymers)
+            UNBOUND_RIBOSOME_KEY: unbound_ribosomes - original_unbound_ribosomes,
+            **elongation.complete_polymers}
 
         molecules = {
-            key: count * -1
-            for key, count in elongation.monomers.items()}
-
-        original = set(original_ribosome_keys)
-        current = set(ribosomes.keys())
-        bound_ribosomes = current - original
-        completed_ribosomes = original - current
-        continuing_ribosomes = original - completed_ribosomes
+            monomer: -int(count)
+            for monomer, count in zip(self.monomer_ids, elongation.monomers)}
+
+        # additions and completions were tracked as they happened, so the
+        # final classification avoids rebuilding sets of all ribosome keys
+        removed_ribosome_ids = set(elongation.completed_ids)
+        bound_ribosomes = [
+            id for id in added_ribosome_ids
+            if id not in removed_ribosome_ids]
+        completed_ribosomes = [
+            id for id in original_ribosome_keys
+            if id in removed_ribosome_ids]
+        continuing_ribosomes = [
+            id for id in original_ribosome_keys
+            if id not in removed_ribosome_ids]
 
         # ATP hydrolysis cost is 2 per amino acid elongation
-        molecules['ATP'] = 0
-        molecules['ADP'] = 0
-        for count in elongation.monomers.values():
-            molecules['ATP'] -= 2 * count
-            molecules['ADP'] += 2 * count
+        total_elongated = int(elongation.monomers.sum())
+        molecules['ATP'] = -2 * total_elongated
+        molecules['ADP'] = 2 * total_elongated
 
         ribosome_updates = {
             id: ribosomes[id]